@@ -1,12 +1,28 @@
 import asyncio
+import json
+import re
 import yaml
 import os
+import shutil
 import sys
-from typing import Dict, Any, List
+import tempfile
+from typing import Dict, Any, List, Iterator
+
+try:
+    from yaml import CSafeLoader
+except ImportError: # PyYAML built without libyaml
+    from yaml import SafeLoader as CSafeLoader
+# libyaml's emitter escapes emoji (non-BMP) even with allow_unicode, so output uses the Python dumper
+from yaml import SafeDumper
+
+try:
+    import ahocorasick # Optional: pyahocorasick
+except ImportError:
+    ahocorasick = None
 
 # Import Utils
 from utils.config_loader import load_config
-from core.ip_checker import IPChecker
+from core.ip_checker import IPChecker, CHECK_HOSTS, DEFAULT_CACHE_PATH
 from core.clash_api import ClashController
 
 # --- CONFIGURATION ---
@@ -20,13 +36,38 @@ OUTPUT_SUFFIX = cfg.get('output_suffix', "_checked")
 FAST_MODE = cfg.get('fast_mode', False) # Default to False if not in config
 SKIP_KEYWORDS = cfg.get('skip_keywords', ["剩余", "重置", "到期", "有效期", "官网", "网址", "更新", "公告"])
 HEADLESS = cfg.get('headless', True)
+IP_CACHE_PATH = cfg.get('ip_cache_path', DEFAULT_CACHE_PATH) # Empty disables the on-disk cache
+# Each Clash instance owns a single global selector, so it can only test one node at a time.
+# Every extra instance (same profile, different controller / mixed-port) adds one concurrent worker.
+CLASH_INSTANCES = [{'clash_api_url': CLASH_API_URL, 'clash_api_secret': CLASH_API_SECRET}] + (cfg.get('extra_clash_instances') or [])
 
-async def test_single_proxy(controller: ClashController, checker: IPChecker, proxy_name: str, selector: str, local_proxy: str, fast_mode: bool = FAST_MODE) -> Dict[str, Any]:
+def build_skip_matcher(keywords):
+    """
+    Builds a single-pass matcher for the skip keywords.
+    Uses an Aho-Corasick automaton when pyahocorasick is installed, otherwise one compiled alternation.
+    """
+    keywords = [str(kw) for kw in keywords if kw]
+    if not keywords:
+        return lambda name: False
+
+    if ahocorasick:
+        automaton = ahocorasick.Automaton()
+        for kw in keywords:
+            automaton.add_word(kw, kw)
+        automaton.make_automaton()
+        return lambda name: next(automaton.iter(name), None) is not None
+
+    pattern = re.compile("|".join(map(re.escape, keywords)))
+    return lambda name: pattern.search(name) is not None
+
+is_status_node = build_skip_matcher(SKIP_KEYWORDS)
+
+async def test_single_proxy(controller: ClashController, checker: IPChecker, proxy_name: str, selector: str, local_proxy: str, fast_mode: bool = FAST_MODE, progress: str = "") -> Dict[str, Any]:
     """
     Tests a single proxy: switches to it, waits, and checks IP.
     Returns the result dictionary (or error dict).
     """
-    print(f"\nTesting: {proxy_name}")
+    print(f"\n{progress}Testing: {proxy_name}")
     
     # 1. Switch Node
     print(f"  -> Switching {selector} ...")
@@ -35,8 +76,10 @@ async def test_single_proxy(controller: ClashController, checker: IPChecker, pro
         print("  -> Switch failed, skipping IP check.")
         return {"full_string": "【❌ Switch Error】", "ip": "Error", "pure_score": "?", "bot_score": "?"}
 
-    # 2. Wait for switch to take effect
-    await asyncio.sleep(1) 
+    # 2. Wait for switch to take effect, dropping the checker's tunnels still bound to the previous node
+    if not await controller.wait_until_switched(selector, proxy_name):
+        print("  -> Switch not confirmed by API, checking anyway...")
+    await controller.close_connections(CHECK_HOSTS)
 
     # 3. Check IP
     print(f"  -> Running IP Check ({'Fast Mode' if fast_mode else 'Browser Mode'})...")
@@ -44,7 +87,10 @@ async def test_single_proxy(controller: ClashController, checker: IPChecker, pro
     
     if fast_mode:
         res = await checker.check_fast(proxy=local_proxy)
-    else:
+        if res.get('pure_score') == '❓':
+            print("     Fast check inconclusive, falling back to Browser Mode...")
+
+    if not res or res.get('pure_score') == '❓':
         # Browser Mode with Retry
         for attempt in range(2):
             try:
@@ -74,40 +120,247 @@ async def test_single_proxy(controller: ClashController, checker: IPChecker, pro
     
     return res
 
+def iter_proxy_names(stream) -> Iterator[str]:
+    """
+    Streams the top-level 'proxies' list from the YAML event stream and yields each proxy name.
+    Only the names are kept; the document tree is never built.
+    """
+    # One entry per open collection: [is_mapping, expecting_key, current_key, role]
+    stack = []
+    for event in yaml.parse(stream, Loader=CSafeLoader):
+        if isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            stack.pop()
+            continue
+        if not isinstance(event, yaml.NodeEvent):
+            continue # Stream/Document markers
+
+        parent = stack[-1] if stack else None
+        key = None
+        if parent and parent[0]:
+            if parent[1]:
+                # This node is a mapping key
+                parent[1] = False
+                parent[2] = event.value if isinstance(event, yaml.ScalarEvent) else None
+                if isinstance(event, yaml.CollectionStartEvent):
+                    stack.append([isinstance(event, yaml.MappingStartEvent), True, None, None])
+                continue
+            key = parent[2]
+            parent[1] = True
+        parent_role = parent[3] if parent else None
+
+        if isinstance(event, yaml.CollectionStartEvent):
+            is_mapping = isinstance(event, yaml.MappingStartEvent)
+            role = None
+            if len(stack) == 1 and key == 'proxies' and not is_mapping:
+                role = 'proxies'
+            elif parent_role == 'proxies' and is_mapping:
+                role = 'proxy'
+            stack.append([is_mapping, True, None, role])
+        elif isinstance(event, yaml.AliasEvent):
+            if parent_role == 'proxies' or (parent_role == 'proxy' and key == 'name'):
+                raise ValueError("Aliased proxy entries are not supported")
+        elif parent_role == 'proxy' and key == 'name':
+            yield event.value
+
+_TOP_KEY_RE = re.compile(r"^([^\s#\-][^:]*):(.*)$")
+_ITEM_RE = re.compile(r"^(\s*)-(\s+|$)")
+_FLOW_ITEM_RE = re.compile(r"^(\s*-\s+)(\{.*\})(\s*(?:#.*)?)$")
+# Keys may be plain or quoted ('name': / "proxies":)
+_NAME_RE = re.compile(r"^(\s*(?:-\s+)?)((['\"]?)name\3:)(\s+)(.*?)\s*$")
+_GROUP_PROXIES_RE = re.compile(r"^(\s*(?:-\s+)?)((['\"]?)proxies\3:)\s*(.*?)\s*$")
+_KEY_RE = re.compile(r"^\s*(?:-\s+)?(\"[^\"]*\"|'[^']*'|[^\s'\"#][^:#]*?)\s*:(?:\s|$)")
+_MEMBER_RE = re.compile(r"^(\s*-\s+)(.*?)\s*$")
+
+class _AmbiguousLine(Exception):
+    pass
+
+def _parse_scalar(token: str) -> str:
+    """Parses a one-line YAML string scalar; anchors, tags, block and flow values are ambiguous."""
+    if not token or token[0] in "&*!|>{[#":
+        raise _AmbiguousLine(token)
+    try:
+        value = yaml.load(token, Loader=CSafeLoader)
+    except yaml.YAMLError:
+        raise _AmbiguousLine(token)
+    if not isinstance(value, str):
+        raise _AmbiguousLine(token)
+    return value
+
+def _is_proxies_key(line: str) -> bool:
+    key = _KEY_RE.match(line)
+    if not key:
+        return False
+    try:
+        return yaml.load(key.group(1), Loader=CSafeLoader) == 'proxies'
+    except yaml.YAMLError:
+        return True # Unparseable key: treat as a possible member list
+
+def _parse_flow(text: str):
+    """Parses a one-line flow collection; anchors, aliases and tags are ambiguous."""
+    if any(c in text for c in "&*!"):
+        raise _AmbiguousLine(text)
+    try:
+        return yaml.load(text, Loader=CSafeLoader)
+    except yaml.YAMLError:
+        raise _AmbiguousLine(text)
+
+def _dump_flow(value) -> str:
+    return yaml.dump(value, Dumper=SafeDumper, allow_unicode=True, default_flow_style=True, sort_keys=False, width=2**31 - 1).strip()
+
+def _quote(value: str) -> str:
+    # A JSON string is also a valid double-quoted YAML scalar
+    return json.dumps(value, ensure_ascii=False)
+
+def rewrite_config_names(config_path: str, output_path: str, name_mapping: Dict[str, str]) -> bool:
+    """
+    Streams the original config into output_path line by line, renaming proxy definitions
+    and their proxy-group references. All other lines are copied untouched.
+    Returns False when the layout is too irregular to patch safely (multi-line flow collections,
+    anchors, block scalars...); the caller should then fall back to a full YAML dump.
+    output_path is only replaced once the whole file has been patched, so it may be config_path itself.
+    """
+    renamed = set()
+    section = None
+    seq_indent = -1 # Dash indentation of the section's top-level items
+    item_indent = -1 # Key indentation inside the current proxy item
+    members_indent = -1 # Key indentation of an open block 'proxies:' list inside a group
+
+    # Same directory as the output so the final os.replace stays on one filesystem
+    tmp = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=os.path.dirname(os.path.abspath(output_path)),
+                                      prefix='.' + os.path.basename(output_path) + '.', suffix='.tmp', delete=False)
+    patched = False
+    try:
+        with open(config_path, 'r', encoding='utf-8-sig') as src, tmp as dst:
+            for line in src:
+                body = line.rstrip("\r\n")
+                stripped = body.strip()
+                if not stripped or stripped.startswith("#") or stripped in ("---", "..."):
+                    dst.write(line)
+                    continue
+
+                top = _TOP_KEY_RE.match(body)
+                if top:
+                    section = top.group(1).strip().strip("'\"")
+                    seq_indent = item_indent = members_indent = -1
+                    rest = top.group(2).strip()
+                    if section in ('proxies', 'proxy-groups') and rest and not rest.startswith("#"):
+                        raise _AmbiguousLine(body) # Whole section written as one flow value
+                    dst.write(line)
+                    continue
+
+                if section not in ('proxies', 'proxy-groups'):
+                    dst.write(line)
+                    continue
+
+                if stripped.count("{") != stripped.count("}") or stripped.count("[") != stripped.count("]"):
+                    raise _AmbiguousLine(body) # Possibly a multi-line flow collection
+
+                indent = len(body) - len(body.lstrip(" "))
+                item = _ITEM_RE.match(body)
+                if item and seq_indent < 0:
+                    seq_indent = indent
+                is_entry = bool(item) and indent == seq_indent
+
+                if section == 'proxies':
+                    flow = _FLOW_ITEM_RE.match(body) if is_entry else None
+                    if flow:
+                        proxy = _parse_flow(flow.group(2))
+                        old = proxy.get('name') if isinstance(proxy, dict) else None
+                        if old in name_mapping:
+                            proxy['name'] = name_mapping[old]
+                            renamed.add(old)
+                            line = f"{flow.group(1)}{_dump_flow(proxy)}{flow.group(3)}\n"
+                        dst.write(line)
+                        continue
+                    if is_entry:
+                        item_indent = len(item.group(1)) + 1 + len(item.group(2))
+                    name = _NAME_RE.match(body)
+                    if name and (is_entry or (not item and indent == item_indent)):
+                        old = _parse_scalar(name.group(5))
+                        if old in name_mapping:
+                            renamed.add(old)
+                            line = f"{name.group(1)}{name.group(2)}{name.group(4)}{_quote(name_mapping[old])}\n"
+                    dst.write(line)
+                    continue
+
+                # proxy-groups: rewrite member references
+                if members_indent >= 0:
+                    if item and indent >= members_indent:
+                        member = _MEMBER_RE.match(body)
+                        old = _parse_scalar(member.group(2))
+                        if old in name_mapping:
+                            line = f"{member.group(1)}{_quote(name_mapping[old])}\n"
+                        dst.write(line)
+                        continue
+                    if indent > members_indent:
+                        raise _AmbiguousLine(body)
+                    members_indent = -1
+
+                flow = _FLOW_ITEM_RE.match(body) if is_entry else None
+                if flow:
+                    group = _parse_flow(flow.group(2))
+                    if isinstance(group, dict) and isinstance(group.get('proxies'), list):
+                        group['proxies'] = [name_mapping.get(p, p) for p in group['proxies']]
+                        line = f"{flow.group(1)}{_dump_flow(group)}{flow.group(3)}\n"
+                    dst.write(line)
+                    continue
+
+                group_proxies = _GROUP_PROXIES_RE.match(body)
+                if group_proxies:
+                    prefix, key, _, value = group_proxies.groups()
+                    if not value or value.startswith("#"):
+                        members_indent = len(prefix)
+                    elif value.startswith("["):
+                        members = _parse_flow(value)
+                        if not isinstance(members, list):
+                            raise _AmbiguousLine(body)
+                        line = f"{prefix}{key} {_dump_flow([name_mapping.get(p, p) for p in members])}\n"
+                    else:
+                        raise _AmbiguousLine(body)
+                elif stripped.startswith("?") or _is_proxies_key(body):
+                    # Complex key, or a member list spelled in a way the patterns above do not cover
+                    raise _AmbiguousLine(body)
+                dst.write(line)
+        # Every renamed proxy definition must have been found
+        patched = renamed == set(name_mapping)
+    except _AmbiguousLine:
+        pass
+    finally:
+        tmp.close()
+        try:
+            if patched:
+                # NamedTemporaryFile is created 0600; keep the permissions the profile already had
+                shutil.copymode(output_path if os.path.exists(output_path) else config_path, tmp.name)
+                os.replace(tmp.name, output_path)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name) # Not patched, or the swap itself failed
+    return patched
+
 def save_config_results(original_config: dict, results_map: Dict[str, str], output_path: str):
     """
     Appends results to proxy names and saves the new config file.
     """
     print("\nUpdating config names...")
-    new_proxies = []
     name_mapping = {} # Old -> New
 
-    proxies = original_config.get('proxies', [])
-    for proxy in proxies:
+    # Renamed in place: the dicts are shared with original_config['proxies']
+    for proxy in original_config.get('proxies') or []:
         old_name = proxy['name']
         if old_name in results_map:
             new_name = f"{old_name} {results_map[old_name]}"
             proxy['name'] = new_name
             name_mapping[old_name] = new_name
-        new_proxies.append(proxy)
-    
-    original_config['proxies'] = new_proxies
 
     # Update groups
-    if 'proxy-groups' in original_config:
-        for group in original_config['proxy-groups']:
-            if 'proxies' in group:
-                new_group_proxies = []
-                for p_name in group['proxies']:
-                    if p_name in name_mapping:
-                        new_group_proxies.append(name_mapping[p_name])
-                    else:
-                        new_group_proxies.append(p_name)
-                group['proxies'] = new_group_proxies
+    rename = name_mapping.get
+    for group in original_config.get('proxy-groups') or []:
+        if 'proxies' in group:
+            group['proxies'][:] = [rename(p_name, p_name) for p_name in group['proxies']]
     
     try:
         with open(output_path, 'w', encoding='utf-8') as f:
-            yaml.dump(original_config, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+            yaml.dump(original_config, f, Dumper=SafeDumper, allow_unicode=True, default_flow_style=False, sort_keys=False)
         print(f"\nSuccess! Saved updated config to: {output_path}")
     except Exception as e:
         print(f"Error saving config: {e}")
@@ -118,65 +371,76 @@ async def main():
         print(f"Error: Config file not found at {CLASH_CONFIG_PATH}")
         return
 
+    # Only the proxy names are needed for testing; the full tree is loaded at save time.
     try:
         with open(CLASH_CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config_data = yaml.full_load(f)
+            proxies = list(iter_proxy_names(f))
     except Exception as e:
         print(f"Error parsing YAML: {e}")
         return
 
-    proxies = config_data.get('proxies', [])
     if not proxies:
         print("No 'proxies' found in config.")
         return
 
     print(f"Found {len(proxies)} proxies to test.")
     
-    controller = ClashController(CLASH_API_URL, CLASH_API_SECRET)
-    
-    # FORCE GLOBAL MODE
-    await controller.set_mode("global")
-    
-    # DETECT PORT
-    mixed_port = await controller.get_running_port()
-    print(f"Detected Running Port from API: {mixed_port}")
-
-    local_proxy_url = f"http://127.0.0.1:{mixed_port}"
-    print(f"Using Local Proxy: {local_proxy_url}")
-    
     selector_to_use = SELECTOR_NAME
-    # (Optional) Verify selector existence logic could go here, omitting for brevity/fidelity to original flow for now
 
-    checker = IPChecker(headless=HEADLESS)
-    await checker.start()
+    # One worker per Clash instance: (controller, local proxy url)
+    workers = []
+    for inst in CLASH_INSTANCES:
+        controller = ClashController(inst.get('clash_api_url', CLASH_API_URL), inst.get('clash_api_secret', ""))
+        print(f"\nClash API: {controller.api_url}")
+        
+        # FORCE GLOBAL MODE & DETECT PORT
+        mixed_port, selectors = await controller.bootstrap("global")
+        print(f"Detected Running Port from API: {mixed_port}")
+        if selectors and selector_to_use not in selectors:
+            print(f"Warning: Selector '{selector_to_use}' not found. Available: {', '.join(selectors)}")
+
+        local_proxy_url = f"http://127.0.0.1:{mixed_port}"
+        print(f"Using Local Proxy: {local_proxy_url}")
+        workers.append((controller, local_proxy_url))
+
+    if len(workers) > 1:
+        print(f"\nTesting with {len(workers)} concurrent workers.")
+
+    checker = IPChecker(headless=HEADLESS, cache_path=IP_CACHE_PATH)
+    if not FAST_MODE:
+        await checker.start() # Fast mode only launches the browser on fallback
 
     results_map = {} # name -> result_string
 
-    try:
-        for i, proxy in enumerate(proxies):
-            name = proxy['name']
-            
-            # Check Skip logic
-            should_skip = False
-            for kw in SKIP_KEYWORDS:
-                if kw in name:
-                    should_skip = True
-                    break
-            
-            if should_skip:
-                print(f"\n[{i+1}/{len(proxies)}] Skipping (Status Node): {name}")
-                continue
-            
-            print(f"[{i+1}/{len(proxies)}] Progress...", end="") 
+    # Work queue shared by all workers
+    queue = asyncio.Queue()
+    for i, name in enumerate(proxies):
+        # Check Skip logic
+        if is_status_node(name):
+            print(f"\n[{i+1}/{len(proxies)}] Skipping (Status Node): {name}")
+            continue
+        
+        queue.put_nowait((i, name))
 
-            # CALL TEST FUNCTION
-            res = await test_single_proxy(controller, checker, name, selector_to_use, local_proxy_url)
+    async def worker(controller: ClashController, local_proxy: str):
+        while True:
+            try:
+                i, name = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            
+            # CALL TEST FUNCTION (progress is printed on the same line as the node, workers run concurrently)
+            res = await test_single_proxy(controller, checker, name, selector_to_use, local_proxy, progress=f"[{i+1}/{len(proxies)}] ")
             results_map[name] = res['full_string']
 
+    try:
+        await asyncio.gather(*(worker(controller, local_proxy) for controller, local_proxy in workers))
     except KeyboardInterrupt:
         print("\nProcess interrupted by user. Saving current progress...")
     finally:
         await checker.stop()
+        for controller, _ in workers:
+            await controller.close()
 
     # SAVE RESULTS
     base = os.path.basename(CLASH_CONFIG_PATH)
@@ -184,9 +448,36 @@ async def main():
     output_filename = f"{filename}{OUTPUT_SUFFIX}{ext}"
     output_path = os.path.join(os.getcwd(), output_filename)
     
+    # Patch names line by line; only irregular layouts pay for a full load + dump
+    name_mapping = {name: f"{name} {res}" for name, res in results_map.items()}
+    try:
+        patched = rewrite_config_names(CLASH_CONFIG_PATH, output_path, name_mapping)
+    except Exception as e:
+        print(f"Line-based rename failed: {e}")
+        patched = False
+    if patched:
+        print(f"\nSuccess! Saved updated config to: {output_path}")
+        return
+
+    try:
+        with open(CLASH_CONFIG_PATH, 'r', encoding='utf-8') as f:
+            config_data = yaml.load(f, Loader=CSafeLoader)
+    except Exception as e:
+        print(f"Error parsing YAML: {e}")
+        return
+    if not isinstance(config_data, dict):
+        print(f"Error parsing YAML: {CLASH_CONFIG_PATH} is not a mapping")
+        return
+
     save_config_results(config_data, results_map, output_path)
 
 if __name__ == "__main__":
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    else:
+        try:
+            import uvloop # Optional: faster event loop
+            uvloop.install()
+        except ImportError:
+            pass
     asyncio.run(main())
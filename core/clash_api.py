@@ -1,6 +1,20 @@
-import aiohttp
+import asyncio
 import urllib.parse
 
+try:
+    import orjson # Optional: faster JSON
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode() # aiohttp expects str
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+def _matches_host(metadata, hosts):
+    host = (metadata.get('host') or metadata.get('sniffHost') or '').lower()
+    return any(host == h or host.endswith('.' + h) for h in hosts)
+
 class ClashController:
     def __init__(self, api_url, secret=""):
         self.api_url = api_url.rstrip('/')
@@ -8,62 +22,148 @@ class ClashController:
             "Authorization": f"Bearer {secret}",
             "Content-Type": "application/json"
         }
+        self._session = None
+        self._configs_cache = None # Last GET /configs payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get_session(self):
+        """Returns the shared keep-alive session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            import aiohttp # Deferred: only needed once the API is actually called
+
+            # All calls go to the same controller; a few pooled connections are enough
+            connector = aiohttp.TCPConnector(limit=32, limit_per_host=4, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers, json_serialize=_json_dumps)
+        return self._session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
 
     async def switch_proxy(self, selector, proxy_name):
         """Switches the selector to the specified proxy."""
         url = f"{self.api_url}/proxies/{urllib.parse.quote(selector)}"
         payload = {"name": proxy_name}
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.put(url, json=payload, headers=self.headers, timeout=5) as resp:
-                    if resp.status == 204:
-                        return True
-                    else:
-                        print(f"Failed to switch to {proxy_name}. Status: {resp.status}")
-                        return False
+            session = await self._get_session()
+            async with session.put(url, json=payload, timeout=5) as resp:
+                if resp.status == 204:
+                    return True
+                else:
+                    print(f"Failed to switch to {proxy_name}. Status: {resp.status}")
+                    return False
         except Exception as e:
             print(f"API Error switching to {proxy_name}: {e}")
             return False
 
+    async def get_configs(self, refresh=False):
+        """Fetches the running configs, cached after the first successful call."""
+        if self._configs_cache is None or refresh:
+            try:
+                session = await self._get_session()
+                async with session.get(f"{self.api_url}/configs") as resp:
+                    if resp.status == 200:
+                        self._configs_cache = _json_loads(await resp.read())
+            except Exception as e:
+                print(f"API Error fetching configs: {e}")
+        return self._configs_cache or {}
+
+    async def wait_until_switched(self, selector, expected_name, timeout=3.0, interval=0.1):
+        """Polls the selector until it reports expected_name as active. Returns False on timeout."""
+        url = f"{self.api_url}/proxies/{urllib.parse.quote(selector)}"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                session = await self._get_session()
+                async with session.get(url, timeout=timeout) as resp:
+                    if resp.status == 200 and _json_loads(await resp.read()).get('now') == expected_name:
+                        return True
+            except Exception:
+                pass
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(interval)
+
+    async def close_connections(self, hosts):
+        """
+        Closes the active connections to the given hosts (and their subdomains), leaving all other traffic alone.
+        Keep-alive tunnels opened before a switch would otherwise keep using the previous node.
+        Returns the number of connections closed.
+        """
+        try:
+            session = await self._get_session()
+            async with session.get(f"{self.api_url}/connections", timeout=5) as resp:
+                if resp.status != 200:
+                    return 0
+                connections = _json_loads(await resp.read()).get('connections') or []
+            ids = [c['id'] for c in connections if _matches_host(c.get('metadata') or {}, hosts)]
+            closed = await asyncio.gather(*(self._close_connection(session, conn_id) for conn_id in ids))
+            return sum(closed)
+        except Exception as e:
+            print(f"API Error closing connections: {e}")
+            return 0
+
+    async def _close_connection(self, session, conn_id):
+        async with session.delete(f"{self.api_url}/connections/{urllib.parse.quote(conn_id)}", timeout=5) as resp:
+            return resp.status == 204
+
     async def set_mode(self, mode):
         """Sets the Clash mode (global, rule, direct)."""
+        if self._configs_cache and str(self._configs_cache.get('mode', '')).lower() == mode:
+            print(f"Mode already set to: {mode}")
+            return True
+
         url = f"{self.api_url}/configs"
         payload = {"mode": mode}
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.patch(url, json=payload, headers=self.headers, timeout=5) as resp:
-                    if resp.status == 204:
-                        print(f"Successfully set mode to: {mode}")
-                        return True
-                    else:
-                        print(f"Failed to set mode logic. Status: {resp.status}")
-                        return False
+            session = await self._get_session()
+            async with session.patch(url, json=payload, timeout=5) as resp:
+                if resp.status == 204:
+                    print(f"Successfully set mode to: {mode}")
+                    if self._configs_cache is not None:
+                        self._configs_cache['mode'] = mode
+                    return True
+                else:
+                    print(f"Failed to set mode logic. Status: {resp.status}")
+                    return False
         except Exception as e:
             print(f"API Error setting mode: {e}")
             return False
 
     async def get_running_port(self):
         """Fetches the mixed-port or http-port from running instance."""
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.api_url}/configs", headers=self.headers) as resp:
-                    if resp.status == 200:
-                        conf = await resp.json()
-                        if conf.get('mixed-port', 0) != 0: return conf['mixed-port']
-                        if conf.get('port', 0) != 0: return conf['port']
-                        if conf.get('socks-port', 0) != 0: return conf['socks-port']
-        except Exception:
-            pass
+        conf = await self.get_configs()
+        if conf.get('mixed-port', 0) != 0: return conf['mixed-port']
+        if conf.get('port', 0) != 0: return conf['port']
+        if conf.get('socks-port', 0) != 0: return conf['socks-port']
         return 7890 # Default fallback
-    
+
+    async def bootstrap(self, mode="global"):
+        """
+        Prepares the instance for testing in as few round-trips as possible.
+        Returns (running port, selector group names).
+        """
+        _, proxies = await asyncio.gather(self.get_configs(), self.get_proxies())
+        await self.set_mode(mode) # Skipped when the cached configs already match
+        port = await self.get_running_port()
+        selectors = [name for name, p in (proxies or {}).items() if p.get('type') == 'Selector']
+        return port, selectors
+
     async def get_proxies(self):
         """Fetches all proxies."""
         try:
-             async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.api_url}/proxies", headers=self.headers) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        return data.get('proxies', {})
+            session = await self._get_session()
+            async with session.get(f"{self.api_url}/proxies") as resp:
+                if resp.status == 200:
+                    data = _json_loads(await resp.read())
+                    return data.get('proxies', {})
         except Exception as e:
             print(f"Error fetching proxies: {e}")
             return None
@@ -1,17 +1,66 @@
 import asyncio
+import os
 import re
-import aiohttp
-from curl_cffi.requests import AsyncSession
-from playwright.async_api import async_playwright
+import sqlite3
+import time
+# aiohttp, curl_cffi and playwright are imported on first use to keep startup fast
+
+# Precompiled patterns for IP validation and IPPure page parsing
+_IPV4_RE = re.compile(r"^\d{1,3}(\.\d{1,3}){3}$")
+# Single pass over the page text; the score lookahead keeps labels between it and its value scannable
+_ALL_RE = re.compile(
+    r"IPPure系数(?=.*?(?P<pure>\d+%))"
+    r"|bot\s*(?P<bot>\d+(?:\.\d+)?)%"
+    r"|IP属性\s*\n?\s*(?P<attr>[^\n]+)"
+    r"|IP来源\s*\n?\s*(?P<src>[^\n]+)",
+    re.DOTALL | re.IGNORECASE
+)
+_IP_RE = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+_TRAIL_IP_RE = re.compile(r"IP$")
+
+# Resources not needed for text extraction
+_BLOCK_TYPES = frozenset({"image", "media", "font", "stylesheet"})
+
+async def _route_handler(route):
+    if route.request.resource_type in _BLOCK_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+# Resolves once the IPPure score and bot ratio have been rendered
+_SCORES_READY_JS = r"() => { const t = document.body.innerText; return /IPPure系数[\s\S]*?\d+%/.test(t) && /bot\s*\d+(\.\d+)?%/i.test(t); }"
+
+# (upper bound, emoji) - Logic from ipcheck.py with user approved thresholds
+_EMOJI_BUCKETS = ((10, "⚪"), (30, "🟢"), (50, "🟡"), (70, "🟠"), (90, "🔴"))
+_EMOJI_OVER = "⚫"
+
+_CLEAR_STORAGE_JS = "try { localStorage.clear(); sessionStorage.clear(); } catch (e) {}"
+
+# Every host the checks talk to; their pooled tunnels are closed after each switch
+CHECK_HOSTS = ("ippure.com", "api.ipify.org", "v4.ident.me", "my.123169.xyz")
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+# Browser results persisted across runs (most IPs are unchanged between subscription updates)
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.cache/clash-ip-checker.sqlite")
+CACHE_TTL = 24 * 3600 # seconds
 
 class IPChecker:
-    def __init__(self, headless=True):
+    def __init__(self, headless=True, cache_path=DEFAULT_CACHE_PATH):
         self.headless = headless
+        self.cache_path = os.path.expanduser(cache_path) if cache_path else None # Empty disables persistence
         self.browser = None
         self.playwright = None
         self.cache = {} # Map IP -> Result Dict
+        self._contexts = {} # Map proxy url -> persistent BrowserContext
+        self._start_lock = asyncio.Lock() # Concurrent checks may start the browser lazily
+        self._session = None # aiohttp session for get_simple_ip
+        self._db = None # sqlite connection backing self.cache
 
     async def start(self):
+        from playwright.async_api import async_playwright
+
+        self._open_cache()
         self.playwright = await async_playwright().start()
         self.browser = await self.playwright.chromium.launch(
             headless=self.headless,
@@ -19,70 +68,166 @@ class IPChecker:
         )
 
     async def stop(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        for context in self._contexts.values():
+            await context.close()
+        self._contexts.clear()
         if self.browser:
             await self.browser.close()
         if self.playwright:
             await self.playwright.stop()
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def _open_cache(self):
+        """Opens the on-disk cache and loads entries younger than CACHE_TTL into self.cache."""
+        if not self.cache_path or self._db:
+            return
+        try:
+            cache_dir = os.path.dirname(self.cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self._db = sqlite3.connect(self.cache_path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ip_cache "
+                "(ip TEXT PRIMARY KEY, pure TEXT, bot TEXT, attr TEXT, src TEXT, ts INTEGER)"
+            )
+            self._db.execute("DELETE FROM ip_cache WHERE ts < ?", (int(time.time()) - CACHE_TTL,))
+            self._db.commit()
+            for ip, pure, bot, attr, src in self._db.execute("SELECT ip, pure, bot, attr, src FROM ip_cache"):
+                self.cache[ip] = self._make_result(ip, pure, bot, attr, src)
+            if self.cache:
+                print(f"Loaded {len(self.cache)} cached IP results from {self.cache_path}")
+        except (OSError, sqlite3.Error) as e:
+            print(f"     [Warning] IP cache unavailable: {e}")
+            self._db = None
+
+    def _save_cache(self, result):
+        """Write-through of a browser result to the on-disk cache."""
+        if not self._db:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ip_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (result["ip"], result["pure_score"], result["bot_score"], result["ip_attr"], result["ip_src"], int(time.time()))
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"     [Warning] Failed to write IP cache: {e}")
+
+    def _make_result(self, ip, pure, bot, attr, src):
+        """Rebuilds a browser-mode result dict from its stored fields."""
+        result = {
+            "pure_emoji": self.get_emoji(pure), "bot_emoji": self.get_emoji(bot), "ip_attr": attr, "ip_src": src,
+            "pure_score": pure, "bot_score": bot, "full_string": "", "ip": ip, "error": None
+        }
+        result["full_string"] = self.build_full_string(result)
+        return result
+
+    def build_full_string(self, result, with_bot=True):
+        """Formats the 【emoji attr|src】 tag appended to the proxy name."""
+        # Construct String with user requested '|' separator
+        attr = result["ip_attr"] if result["ip_attr"] != "❓" else ""
+        src = result["ip_src"] if result["ip_src"] != "❓" else ""
+        info = f"{attr}|{src}".strip()
+        if info == "|": info = "未知" # Handle empty case gracefully
+        if not info: info = "未知"
+
+        emoji = result["pure_emoji"] + (result["bot_emoji"] if with_bot else "")
+        return f"【{emoji} {info}】"
+
+    async def _get_context(self, proxy):
+        """Returns the persistent context bound to this upstream proxy, creating it on first use."""
+        context = self._contexts.get(proxy)
+        if context is None:
+            context_args = {"user_agent": USER_AGENT}
+            if proxy:
+                context_args["proxy"] = {"server": proxy}
+            context = await self.browser.new_context(**context_args)
+
+            # Resource blocking (Optimization)
+            # Enabling routing also disables Chromium's HTTP cache for this context
+            await context.route("**/*", _route_handler)
+            # Drop web storage left by the previous node's visit before any page script runs
+            await context.add_init_script(_CLEAR_STORAGE_JS)
+            self._contexts[proxy] = context
+        return context
 
     def get_emoji(self, percentage_str):
         try:
-            val = float(percentage_str.replace('%', ''))
-            # Logic from ipcheck.py with user approved thresholds
-            if val <= 10: return "⚪"
-            if val <= 30: return "🟢"
-            if val <= 50: return "🟡"
-            if val <= 70: return "🟠"
-            if val <= 90: return "🔴"
-            return "⚫"
-        except:
+            val = float(percentage_str.rstrip('%'))
+        except (AttributeError, ValueError):
             return "❓"
+        return next((emoji for limit, emoji in _EMOJI_BUCKETS if val <= limit), _EMOJI_OVER)
+
+    async def _get_session(self):
+        """Returns the shared session for the fast IP check, creating it on first use."""
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            # User modified timeout to 3s
+            # force_close: a pooled connection to the local proxy could outlive a node switch
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(force_close=True),
+                timeout=aiohttp.ClientTimeout(total=3)
+            )
+        return self._session
+
+    async def _fetch_ip(self, session, url, proxy):
+        try:
+            async with session.get(url, proxy=proxy) as resp:
+                if resp.status == 200:
+                    ip = (await resp.text()).strip()
+                    if _IPV4_RE.match(ip):
+                        return ip
+        except Exception:
+            pass
+        return None
 
     async def get_simple_ip(self, proxy=None):
-        """Fast IPv4 check for caching."""
+        """Fast IPv4 check for caching. Queries all endpoints at once and keeps the first valid answer."""
         urls = ["http://api.ipify.org", "http://v4.ident.me"]
-        for url in urls:
-            try:
-                # User modified timeout to 3s
-                timeout = aiohttp.ClientTimeout(total=3)
-                async with aiohttp.ClientSession(timeout=timeout) as session:
-                    async with session.get(url, proxy=proxy) as resp:
-                        if resp.status == 200:
-                            ip = (await resp.text()).strip()
-                            if re.match(r"^\d{1,3}(\.\d{1,3}){3}\d{1,3}$", ip):
-                                return ip
-            except Exception:
-                continue 
+        session = await self._get_session()
+        pending = {asyncio.create_task(self._fetch_ip(session, url, proxy)) for url in urls}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
         return None
 
     async def check(self, url="https://ippure.com/", proxy=None, timeout=20000):
-        if not self.browser:
-            await self.start()
+        async with self._start_lock:
+            if not self.browser:
+                await self.start()
         
         # 1. Cleaner Fast IP & Cache Logic
         current_ip = await self.get_simple_ip(proxy)
-        if current_ip and current_ip in self.cache:
+        cached = self.cache.get(current_ip) if current_ip else None
+        # Fast-mode entries (no bot ratio) or unscored ones are not a valid answer for a browser check
+        if cached and cached.get("pure_score") != "❓" and cached.get("bot_score") != "N/A":
             print(f"     [Cache Hit] {current_ip}")
-            return self.cache[current_ip]
+            return cached
         
         if current_ip:
             print(f"     [New IP] {current_ip}")
         else:
             print("     [Warning] Fast IP check failed. Scanning with browser...")
 
-        # 2. Browser Check (Logic from ipcheck.py)
-        context_args = {
-             "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        }
-        if proxy:
-            context_args["proxy"] = {"server": proxy}
-            
-        context = await self.browser.new_context(**context_args)
-        
-        # Resource blocking (Optimization)
-        await context.route("**/*", lambda route: route.abort() 
-            if route.request.resource_type in ["image", "media", "font"] 
-            else route.continue_())
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 
+        # 2. Browser Check (Logic from ipcheck.py)
+        # The proxy url is fixed per Clash instance, so its context is reused across checks
+        context = await self._get_context(proxy)
+        await context.clear_cookies() # Cookies may be tied to the previous exit IP
         page = await context.new_page()
         
         # Default Result Structure
@@ -97,57 +242,53 @@ class IPChecker:
             # Logic from ipcheck.py - Optimized wait
             try:
                 await page.wait_for_selector("text=人机流量比", timeout=10000)
-            except:
+            except PlaywrightTimeoutError:
                 pass 
 
-            await page.wait_for_timeout(2000)
+            # Wait for the values to populate instead of a fixed 2s pad
+            try:
+                await page.wait_for_function(_SCORES_READY_JS, timeout=5000)
+            except PlaywrightTimeoutError:
+                pass
+            await page.wait_for_timeout(300) # Safety net for late text updates
             text = await page.inner_text("body")
 
+            # First match of each field wins
+            fields = {}
+            for m in _ALL_RE.finditer(text):
+                fields.setdefault(m.lastgroup, m.group(m.lastgroup))
+                if len(fields) == 4: break
+
             # 1. IPPure Score
-            score_match = re.search(r"IPPure系数.*?(\d+%)", text, re.DOTALL)
-            if score_match:
-                result["pure_score"] = score_match.group(1)
+            if "pure" in fields:
+                result["pure_score"] = fields["pure"]
                 result["pure_emoji"] = self.get_emoji(result["pure_score"])
 
             # 2. Bot Ratio
-            bot_match = re.search(r"bot\s*(\d+(\.\d+)?)%", text, re.IGNORECASE)
-            if bot_match:
-                val = bot_match.group(0).replace('bot', '').strip()
-                if not val.endswith('%'): val += "%"
+            if "bot" in fields:
+                val = f"{fields['bot']}%"
                 result["bot_score"] = val
                 result["bot_emoji"] = self.get_emoji(val)
 
             # 3. Attributes
-            attr_match = re.search(r"IP属性\s*\n\s*(.+)", text)
-            if not attr_match: attr_match = re.search(r"IP属性\s*(.+)", text)
-            if attr_match:
-                raw = attr_match.group(1).strip()
-                result["ip_attr"] = re.sub(r"IP$", "", raw)
+            if "attr" in fields:
+                result["ip_attr"] = _TRAIL_IP_RE.sub("", fields["attr"].strip())
 
             # 4. Source
-            src_match = re.search(r"IP来源\s*\n\s*(.+)", text)
-            if not src_match: src_match = re.search(r"IP来源\s*(.+)", text)
-            if src_match:
-                raw = src_match.group(1).strip()
-                result["ip_src"] = re.sub(r"IP$", "", raw)
+            if "src" in fields:
+                result["ip_src"] = _TRAIL_IP_RE.sub("", fields["src"].strip())
 
             # 5. Fallback IP if fast check failed
             if result["ip"] == "❓":
-                ip_match = re.search(r"\b(?:\d{1,3}\.){3}\d{1,3}\b", text)
+                ip_match = _IP_RE.search(text)
                 if ip_match: result["ip"] = ip_match.group(0)
 
-            # Construct String with user requested '|' separator
-            attr = result["ip_attr"] if result["ip_attr"] != "❓" else ""
-            src = result["ip_src"] if result["ip_src"] != "❓" else ""
-            info = f"{attr}|{src}".strip()
-            if info == "|": info = "未知" # Handle empty case gracefully
-            if not info: info = "未知"
-            
-            result["full_string"] = f"【{result['pure_emoji']}{result['bot_emoji']} {info}】"
+            result["full_string"] = self.build_full_string(result)
 
             # Cache Update
             if result["ip"] != "❓" and result["pure_score"] != "❓":
                 self.cache[result["ip"]] = result.copy()
+                self._save_cache(result)
 
         except Exception as e:
             result["error"] = str(e)
@@ -157,7 +298,6 @@ class IPChecker:
                 print("     [Debug] Waiting 5s before closing browser window...")
                 await asyncio.sleep(5)
             await page.close()
-            await context.close()
             
         return result
 
@@ -166,6 +306,8 @@ class IPChecker:
         Fast mode using https://my.123169.xyz/v1/info API.
         Skips browser challenge/rendering.
         """
+        from curl_cffi.requests import AsyncSession
+
         url = "https://my.123169.xyz/v1/info"
         result = {
             "pure_emoji": "❓", "bot_emoji": "❓", "ip_attr": "❓", "ip_src": "❓",
@@ -209,17 +351,11 @@ class IPChecker:
                     # Bot emoji is skipped or N/A. The user said: "Although no bot ratio... finally display without bot ratio"
                     # Original: 【⚪🟢 IPAttr|IPSource】
                     # Fast Mode: 【⚪ IPAttr|IPSource】 (Removed bot emoji slot)
-                    
-                    attr = result["ip_attr"] if result["ip_attr"] != "❓" else ""
-                    src = result["ip_src"] if result["ip_src"] != "❓" else ""
-                    info = f"{attr}|{src}".strip()
-                    if info == "|": info = "未知"
-                    if not info: info = "未知"
-
-                    result["full_string"] = f"【{result['pure_emoji']} {info}】"
+                    result["full_string"] = self.build_full_string(result, with_bot=False)
                     
                     # Cache Update (Optional, maybe not needed for fast mode as it is already fast)
-                    if result["ip"] != "❓":
+                    # In-memory only: the on-disk cache holds browser results with a bot ratio
+                    if result["ip"] != "❓" and result["pure_score"] != "❓":
                         self.cache[result["ip"]] = result.copy()
                         
                 else:
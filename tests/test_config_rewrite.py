@@ -0,0 +1,213 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clash_automator import iter_proxy_names, rewrite_config_names
+
+RESULTS = {
+    "香港 01": "【⚪🟢 机房|广播】",
+    "JP, 02": "【🟡 住宅|原生】",
+    "US 03": "【❓❓ 未知】",
+}
+MAPPING = {name: f"{name} {res}" for name, res in RESULTS.items()}
+
+BLOCK = """port: 7890
+proxies:
+  - name: "香港 01"
+    type: ss
+    alpn:
+      - h2
+    plugin-opts: {mode: websocket}
+  - type: vmess
+    name: 'JP, 02' # comment
+    ws-opts:
+      headers:
+        name: US 03
+  - name: US 03
+    type: trojan
+proxy-groups:
+  - name: 🚀 Select
+    type: select
+    proxies:
+      - 香港 01
+      - "JP, 02"
+      - DIRECT
+  - name: Auto
+    type: url-test
+    proxies: [香港 01, 'JP, 02', US 03]
+    use:
+      - provider1
+rules:
+  - MATCH,🚀 Select
+"""
+
+FLOW = """proxies:
+- {name: 香港 01, type: ss, server: a, port: 443}
+- {name: "JP, 02", type: ss, server: b, port: 443}
+- {name: US 03, type: ss, server: c, port: 443}
+proxy-groups:
+- name: G
+  type: select
+  proxies:
+  - 香港 01
+  - JP, 02
+  - US 03
+- {name: G2, type: select, proxies: [香港 01, US 03]}
+"""
+
+QUOTED_KEYS = """"proxies":
+  - "name": 香港 01
+    "type": ss
+  - 'name': JP, 02
+    type: ss
+  - name: US 03
+    type: ss
+"proxy-groups":
+  - "name": G
+    "proxies":
+      - 香港 01
+      - JP, 02
+  - name: G2
+    'proxies': [US 03]
+"""
+
+ANCHOR = """proxies:
+  - &hk {name: 香港 01, type: ss}
+  - {name: "JP, 02", type: ss}
+  - {name: US 03, type: ss}
+proxy-groups:
+  - name: G
+    proxies: [香港 01]
+"""
+
+ALIASED_MEMBERS = """proxies:
+  - {name: 香港 01, type: ss}
+  - {name: "JP, 02", type: ss}
+  - {name: US 03, type: ss}
+proxy-groups:
+  - name: G
+    proxies: &members [香港 01, "JP, 02", US 03]
+  - name: G2
+    proxies: *members
+"""
+
+MULTILINE_FLOW = """proxies:
+  - {name: 香港 01, type: ss,
+     server: a}
+  - {name: "JP, 02", type: ss}
+  - {name: US 03, type: ss}
+"""
+
+ODD_MEMBER_KEY = """proxies:
+  - {name: 香港 01, type: ss}
+  - {name: "JP, 02", type: ss}
+  - {name: US 03, type: ss}
+proxy-groups:
+  - name: G
+    proxies :
+      - 香港 01
+"""
+
+def expected_rename(doc):
+    config = yaml.safe_load(doc)
+    for proxy in config.get("proxies") or []:
+        proxy["name"] = MAPPING.get(proxy["name"], proxy["name"])
+    for group in config.get("proxy-groups") or []:
+        if "proxies" in group:
+            group["proxies"] = [MAPPING.get(p, p) for p in group["proxies"]]
+    return config
+
+class RewriteConfigNamesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, "in.yaml")
+        self.dst = os.path.join(self.tmp.name, "out.yaml")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def rewrite(self, doc, newline="\n"):
+        with open(self.src, "w", encoding="utf-8", newline=newline) as f:
+            f.write(doc)
+        return rewrite_config_names(self.src, self.dst, MAPPING)
+
+    def assertPatched(self, doc, newline="\n"):
+        self.assertTrue(self.rewrite(doc, newline))
+        with open(self.dst, encoding="utf-8") as f:
+            output = f.read()
+        self.assertEqual(yaml.safe_load(output), expected_rename(doc))
+        self.assertNotIn("\\U0001", output)
+
+    def test_block_layout(self):
+        self.assertPatched(BLOCK)
+
+    def test_block_layout_keeps_untouched_lines(self):
+        self.rewrite(BLOCK)
+        with open(self.dst, encoding="utf-8") as f:
+            output = f.read()
+        self.assertIn("        name: US 03\n", output) # nested, not a proxy name
+        self.assertIn("  - MATCH,🚀 Select\n", output)
+
+    def test_flow_layout(self):
+        self.assertPatched(FLOW)
+
+    def test_quoted_keys(self):
+        self.assertPatched(QUOTED_KEYS)
+
+    def test_crlf_line_endings(self):
+        self.assertPatched(BLOCK, newline="\r\n")
+
+    def test_in_place_rewrite(self):
+        with open(self.src, "w", encoding="utf-8") as f:
+            f.write(BLOCK)
+        self.assertTrue(rewrite_config_names(self.src, self.src, MAPPING))
+        with open(self.src, encoding="utf-8") as f:
+            self.assertEqual(yaml.safe_load(f), expected_rename(BLOCK))
+        self.assertEqual(os.listdir(self.tmp.name), ["in.yaml"]) # No temp file left behind
+
+    def test_in_place_fallback_keeps_source(self):
+        with open(self.src, "w", encoding="utf-8") as f:
+            f.write(ANCHOR)
+        self.assertFalse(rewrite_config_names(self.src, self.src, MAPPING))
+        with open(self.src, encoding="utf-8") as f:
+            self.assertEqual(f.read(), ANCHOR)
+        self.assertEqual(os.listdir(self.tmp.name), ["in.yaml"])
+
+    def test_failed_patch_writes_no_output(self):
+        self.assertFalse(self.rewrite(MULTILINE_FLOW))
+        self.assertEqual(os.listdir(self.tmp.name), ["in.yaml"])
+
+    def test_anchored_proxy_falls_back(self):
+        self.assertFalse(self.rewrite(ANCHOR))
+
+    def test_aliased_members_fall_back(self):
+        self.assertFalse(self.rewrite(ALIASED_MEMBERS))
+
+    def test_multiline_flow_falls_back(self):
+        self.assertFalse(self.rewrite(MULTILINE_FLOW))
+
+    def test_unrecognised_member_key_falls_back(self):
+        self.assertFalse(self.rewrite(ODD_MEMBER_KEY))
+
+class IterProxyNamesTest(unittest.TestCase):
+    def test_matches_full_load(self):
+        for doc in (BLOCK, FLOW, QUOTED_KEYS, MULTILINE_FLOW, BLOCK.replace("\n", "\r\n")):
+            expected = [p["name"] for p in yaml.safe_load(doc)["proxies"]]
+            self.assertEqual(list(iter_proxy_names(io.StringIO(doc))), expected)
+
+    def test_no_proxies(self):
+        self.assertEqual(list(iter_proxy_names(io.StringIO("port: 7890\nrules: []\n"))), [])
+
+    def test_aliased_proxy_entry_is_rejected(self):
+        doc = "base: &hk {name: 香港 01}\nproxies:\n  - *hk\n"
+        with self.assertRaises(ValueError):
+            list(iter_proxy_names(io.StringIO(doc)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,3 @@
-import yaml
 import os
 import sys
 
@@ -9,10 +8,16 @@ def load_config(config_path="config.yaml"):
     """
     if not os.path.exists(config_path):
         return None
+
+    import yaml # Deferred: nothing to parse when the file is missing
+    try:
+        from yaml import CSafeLoader
+    except ImportError: # PyYAML built without libyaml
+        from yaml import SafeLoader as CSafeLoader
     
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=CSafeLoader)
     except Exception as e:
         print(f"Error loading config file: {e}")
         return None